@@ -1,21 +1,210 @@
-from fastapi import FastAPI, HTTPException, Request, status
+from fastapi import FastAPI, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, EmailStr, Field, validator
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator
 import httpx
+import orjson
+import asyncio
 import os
-import base64
+import time
 import typing as t
-from datetime import datetime
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
 from dotenv import load_dotenv
 from mangum import Mangum
 
-load_dotenv()
+# En producción las variables las inyecta la plataforma; no se lee el .env.
+if os.getenv("ENVIRONMENT", "dev") != "production":
+    load_dotenv()
+
+
+# La configuración se lee una sola vez al importar el módulo.
+AZURE_ORG = os.getenv("AZURE_DEVOPS_ORG")
+AZURE_PAT = os.getenv("AZURE_DEVOPS_PAT")
+
+
+def _read_max_concurrency() -> int:
+    raw = os.getenv("AZURE_MAX_CONCURRENCY", "10")
+    try:
+        value: t.Optional[int] = int(raw)
+    except ValueError:
+        value = None
+    # Con 0 el semáforo bloquearía todas las llamadas a Azure.
+    if value is None or value < 1:
+        raise RuntimeError(
+            f"Error: AZURE_MAX_CONCURRENCY debe ser un entero mayor o igual a 1 (recibido: {raw!r})."
+        )
+    return value
+
+
+# Límite de llamadas simultáneas a Azure DevOps por proceso, para no provocar
+# ráfagas de 429.
+AZURE_MAX_CONCURRENCY = _read_max_concurrency()
+_azure_sem = asyncio.Semaphore(AZURE_MAX_CONCURRENCY)
+
+HEADERS_JSON = {"Accept": "application/json"}
+HEADERS_PATCH = {**HEADERS_JSON, "Content-Type": "application/json-patch+json"}
+
+
+# El cliente compartido usa la organización como base_url; las llamadas a
+# vsaex.dev.azure.com usan una URL absoluta.
+_AZURE_BASE_URL = f"https://dev.azure.com/{AZURE_ORG}"
+_API_VERSION_PARAMS = {"api-version": "7.1-preview"}
+_PROJECTS_PATH = "/_apis/projects"
+_USERENT_URL = f"https://vsaex.dev.azure.com/{AZURE_ORG}/_apis/userentitlements"
+_WORKITEMS_PATH_TMPL = "/{project}/_apis/wit/workitems/$Bug"
+_WORKITEM_REF_URL_TMPL = _AZURE_BASE_URL + "/{project}/_apis/wit/workItems/{id}"
+
+
+def get_azure_config() -> t.Tuple[str, str]:
+    if not AZURE_ORG or not AZURE_PAT:
+        raise RuntimeError(
+            "Error: El servidor no tiene la configuración necesaria (AZURE_DEVOPS_ORG, AZURE_DEVOPS_PAT)."
+        )
+    return AZURE_ORG, AZURE_PAT
+
+
+class RetryTransport(httpx.AsyncHTTPTransport):
+    """
+    Transporte con reintentos y backoff exponencial para fallos transitorios
+    de Azure DevOps. Respeta la cabecera Retry-After completa; si supera
+    max_retry_after se devuelve la respuesta sin reintentar. La espera total
+    entre intentos no supera max_total_delay, para que la petición termine
+    dentro del tiempo del handler; agotado ese presupuesto se devuelve la
+    última respuesta (o se propaga el último error).
+    Los métodos no idempotentes (POST, PATCH) solo se reintentan cuando Azure
+    no procesó la petición: error de conexión, 429 o 503.
+    Si se indica semaphore, cada intento ocupa un cupo solo mientras se envía;
+    el cupo se libera durante la espera entre intentos.
+    """
+
+    IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+    RETRY_STATUSES = frozenset({429, 502, 503, 504})
+    SAFE_RETRY_STATUSES = frozenset({429, 503})
+
+    def __init__(
+        self,
+        *args: t.Any,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        max_backoff: float = 4.0,
+        max_retry_after: float = 5.0,
+        max_total_delay: float = 5.0,
+        semaphore: t.Optional[asyncio.Semaphore] = None,
+        **kwargs: t.Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.semaphore = semaphore
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.max_total_delay = max_total_delay
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        idempotent = request.method in self.IDEMPOTENT_METHODS
+        statuses = self.RETRY_STATUSES if idempotent else self.SAFE_RETRY_STATUSES
+        attempt = 0
+        waited = 0.0
+        while True:
+            try:
+                response = await self._send(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                delay = self._backoff(attempt)
+                if not self._can_retry(attempt, waited, delay):
+                    raise
+            except (httpx.ReadError, httpx.RemoteProtocolError):
+                delay = self._backoff(attempt)
+                if not idempotent or not self._can_retry(attempt, waited, delay):
+                    raise
+            else:
+                if response.status_code not in statuses:
+                    return response
+                delay = self._retry_after(response)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                elif delay > self.max_retry_after:
+                    return response
+                if not self._can_retry(attempt, waited, delay):
+                    return response
+                await response.aclose()
+            await asyncio.sleep(delay)
+            waited += delay
+            attempt += 1
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        if self.semaphore is None:
+            return await super().handle_async_request(request)
+        async with self.semaphore:
+            return await super().handle_async_request(request)
+
+    def _can_retry(self, attempt: int, waited: float, delay: float) -> bool:
+        return attempt < self.max_retries and waited + delay <= self.max_total_delay
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.backoff_factor * (2**attempt), self.max_backoff)
+
+    def _retry_after(self, response: httpx.Response) -> t.Optional[float]:
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            if retry_at.tzinfo is None:
+                retry_at = retry_at.replace(tzinfo=timezone.utc)
+            delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+        return max(delay, 0.0)
+
+
+_http_client: t.Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    # Cliente compartido creado bajo demanda para reutilizar conexiones
+    # (pool TCP/TLS), también cuando el host ASGI no emite eventos lifespan.
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        transport = RetryTransport(
+            semaphore=_azure_sem,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=100, max_keepalive_connections=20, keepalive_expiry=30
+            ),
+        )
+        _http_client = httpx.AsyncClient(
+            base_url=_AZURE_BASE_URL,
+            headers=HEADERS_JSON,
+            # httpx construye la cabecera Basic una sola vez al crear el cliente.
+            auth=("", AZURE_PAT) if AZURE_PAT else None,
+            transport=transport,
+            timeout=httpx.Timeout(30.0, connect=5.0),
+        )
+    return _http_client
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _http_client
+    try:
+        yield
+    finally:
+        if _http_client is not None:
+            await _http_client.aclose()
+            _http_client = None
+
 
 app = FastAPI(
     title="Azure DevOps Proxy API",
     description="Expose endpoints to list projects and create Bugs in Azure DevOps",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -26,24 +215,18 @@ app.add_middleware(
 )
 
 
-def get_azure_config() -> t.Tuple[str, str]:
-    org = os.getenv("AZURE_DEVOPS_ORG")
-    pat = os.getenv("AZURE_DEVOPS_PAT")
-    if not org or not pat:
-        raise RuntimeError(
-            "Error: El servidor no tiene la configuración necesaria (AZURE_DEVOPS_ORG, AZURE_DEVOPS_PAT)."
-        )
-    return org, pat
-
-
-def build_auth_header(pat: str) -> str:
-    token = f":{pat}".encode("utf-8")
-    b64 = base64.b64encode(token).decode("utf-8")
-    return f"Basic {b64}"
+# Valores estándar de los picklists de Azure DevOps.
+Severity = t.Literal["1 - Critical", "2 - High", "3 - Medium", "4 - Low"]
+Activity = t.Literal[
+    "Deployment", "Design", "Development", "Documentation", "Requirements", "Testing"
+]
 
 
 class BugCreateRequest(BaseModel):
-    project: str
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+
+    # Un proyecto vacío generaría "//_apis/..." y escaparía de base_url.
+    project: str = Field(..., min_length=1)
     userStoryId: int
     title: str
     assignedTo: EmailStr
@@ -51,8 +234,8 @@ class BugCreateRequest(BaseModel):
     effort: float
     cliente: str
     priority: int = Field(..., ge=1, le=4)
-    severity: str
-    activity: str
+    severity: Severity
+    activity: Activity
     tipoDeError: str
     fechaInicioPlaneada: str
     responsableBug: EmailStr
@@ -61,10 +244,13 @@ class BugCreateRequest(BaseModel):
     versionAplicacion: str
     funcionalidad: str
 
-    @validator("fechaInicioPlaneada")
+    @field_validator("fechaInicioPlaneada")
+    @classmethod
     def validate_fecha(cls, v):
         try:
-            datetime.strptime(v, "%Y-%m-%d")
+            if len(v) != 10 or v[4] != "-" or v[7] != "-":
+                raise ValueError
+            date.fromisoformat(v)
         except ValueError:
             raise ValueError("fechaInicioPlaneada debe tener el formato YYYY-MM-DD")
         return v
@@ -101,22 +287,17 @@ async def read_root():
 @app.get("/projects")
 async def list_projects():
     try:
-        org, pat = get_azure_config()
+        get_azure_config()
     except RuntimeError as e:
         raise e
 
-    url = f"https://dev.azure.com/{org}/_apis/projects?api-version=7.1-preview"
-    headers = {
-        "Authorization": build_auth_header(pat),
-        "Accept": "application/json",
-    }
-
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        resp = await client.get(url, headers=headers)
+    resp = await get_http_client().get(_PROJECTS_PATH, params=_API_VERSION_PARAMS)
 
-    if resp.status_code >= 400:
+    # Azure responde a un PAT inválido con 203 y una página HTML de login, por
+    # lo que cualquier estado distinto de 200 se trata como error.
+    if resp.status_code != status.HTTP_200_OK:
         try:
-            content = resp.json()
+            content = orjson.loads(resp.content)
         except Exception:
             content = {"raw_text": resp.text}
         raise HTTPException(
@@ -128,33 +309,74 @@ async def list_projects():
             },
         )
 
-    return resp.json()
+    # Respuesta exitosa: se reenvían los bytes de Azure sin decodificar/re-codificar.
+    return Response(
+        content=resp.content,
+        status_code=status.HTTP_200_OK,
+        media_type=resp.headers.get("content-type", "application/json"),
+    )
+
+
+PRINCIPAL_CACHE_TTL = 3600.0
+PRINCIPAL_CACHE_MAXSIZE = 128
+_principal_cache: t.Dict[t.Tuple[str, str], t.Tuple[float, str]] = {}
+_principal_inflight: t.Dict[t.Tuple[str, str], "asyncio.Task[t.Optional[str]]"] = {}
 
 
 async def find_user_principal_name(
-    org: str, pat: str, display_name: str
+    client: httpx.AsyncClient, display_name: str
 ) -> t.Optional[str]:
-    url = (
-        f"https://vsaex.dev.azure.com/{org}/_apis/userentitlements"
-        f"?api-version=6.0-preview.3&$filter=name eq '{display_name}'"
-    )
-    headers = {
-        "Authorization": build_auth_header(pat),
-        "Accept": "application/json",
+    # Cache TTL por (org, display_name).
+    key = (AZURE_ORG, display_name)
+    cached = _principal_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    # Single-flight: las peticiones concurrentes con la misma clave esperan
+    # la misma búsqueda en lugar de lanzar una llamada cada una.
+    task = _principal_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(
+            _fetch_user_principal_name(client, display_name)
+        )
+        _principal_inflight[key] = task
+        task.add_done_callback(lambda _: _principal_inflight.pop(key, None))
+    # shield evita que la cancelación de un solicitante cancele a los demás.
+    principal = await asyncio.shield(task)
+
+    # Solo se cachean aciertos para no fijar un fallo transitorio durante el TTL.
+    if principal:
+        if (
+            key not in _principal_cache
+            and len(_principal_cache) >= PRINCIPAL_CACHE_MAXSIZE
+        ):
+            _principal_cache.pop(next(iter(_principal_cache)))
+        _principal_cache[key] = (time.monotonic() + PRINCIPAL_CACHE_TTL, principal)
+    return principal
+
+
+async def _fetch_user_principal_name(
+    client: httpx.AsyncClient, display_name: str
+) -> t.Optional[str]:
+    # OData escapa la comilla simple duplicándola; httpx codifica la query.
+    escaped_name = display_name.replace("'", "''")
+    params = {
+        "api-version": "6.0-preview.3",
+        "$filter": f"name eq '{escaped_name}'",
     }
+    resp = await client.get(_USERENT_URL, params=params)
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        resp = await client.get(url, headers=headers)
-
-    if resp.status_code >= 400:
+    # Un 203 con la página HTML de login (PAT inválido) no es JSON.
+    if resp.status_code != status.HTTP_200_OK:
         return None
 
-    data = resp.json()
+    data = orjson.loads(resp.content)
     users = data.get("members") or data.get("value") or []
 
+    target = display_name.strip().casefold()
     for user in users:
         name = user.get("user", {}).get("displayName") or user.get("name", "")
-        if name.strip().lower() == display_name.strip().lower():
+        if name.strip().casefold() == target:
             principal = user.get("user", {}).get("principalName")
             if principal:
                 return principal
@@ -165,16 +387,35 @@ async def find_user_principal_name(
     return None
 
 
+# Campos del Bug que se copian tal cual desde BugCreateRequest: (path, atributo).
+_BUG_FIELD_PATHS: t.Tuple[t.Tuple[str, str], ...] = (
+    ("/fields/System.Title", "title"),
+    ("/fields/System.AssignedTo", "assignedTo"),
+    ("/fields/Microsoft.VSTS.TCM.ReproSteps", "reproSteps"),
+    ("/fields/Microsoft.VSTS.Scheduling.Effort", "effort"),
+    ("/fields/Microsoft.VSTS.Common.Priority", "priority"),
+    ("/fields/Microsoft.VSTS.Common.Severity", "severity"),
+    ("/fields/Microsoft.VSTS.Common.Activity", "activity"),
+    ("/fields/Custom.Cliente", "cliente"),
+    ("/fields/Custom.Tipodeerror", "tipoDeError"),
+    ("/fields/Custom.ResponsableBug", "responsableBug"),
+    ("/fields/Custom.33ece249-f3ca-4b23-a86a-0c605534caa3", "aplicacion"),
+    ("/fields/Custom.f82dc49a-eb67-44c3-ac65-de18fee91f0b", "versionAplicacion"),
+    ("/fields/Custom.Funcionalidadquepresentaelerror", "funcionalidad"),
+)
+
+
 @app.post("/bugs", status_code=status.HTTP_201_CREATED)
 async def create_bug(request_body: BugCreateRequest):
     try:
-        org, pat = get_azure_config()
+        get_azure_config()
     except RuntimeError as e:
         raise e
 
     fecha_con_hora = f"{request_body.fechaInicioPlaneada}T00:00:00-05:00"
     TESTER_NAME = "Antony Daniel Gutierrez Salgado"
-    tester_principal = await find_user_principal_name(org, pat, TESTER_NAME)
+    client = get_http_client()
+    tester_principal = await find_user_principal_name(client, TESTER_NAME)
 
     if not tester_principal:
         raise HTTPException(
@@ -182,106 +423,57 @@ async def create_bug(request_body: BugCreateRequest):
             detail=f"No se pudo encontrar el usuario Tester '{TESTER_NAME}' en la organización de Azure DevOps.",
         )
 
-    project = request_body.project
-    url = f"https://dev.azure.com/{org}/{project}/_apis/wit/workitems/$Bug?api-version=7.1-preview"
-
-    headers = {
-        "Authorization": build_auth_header(pat),
-        "Content-Type": "application/json-patch+json",
-        "Accept": "application/json",
-    }
+    # El proyecto se codifica como un único segmento: un valor como "/x" no
+    # debe poder escapar de base_url.
+    project = quote(request_body.project, safe="")
+    url = _WORKITEMS_PATH_TMPL.format(project=project)
 
     patch_ops = [
-        {"op": "add", "path": "/fields/System.Title", "value": request_body.title},
-        {
-            "op": "add",
-            "path": "/fields/System.AssignedTo",
-            "value": request_body.assignedTo,
-        },
-        {
-            "op": "add",
-            "path": "/fields/Microsoft.VSTS.TCM.ReproSteps",
-            "value": request_body.reproSteps,
-        },
-        {
-            "op": "add",
-            "path": "/fields/Microsoft.VSTS.Scheduling.Effort",
-            "value": request_body.effort,
-        },
-        {
-            "op": "add",
-            "path": "/fields/Microsoft.VSTS.Common.Priority",
-            "value": request_body.priority,
-        },
-        {
-            "op": "add",
-            "path": "/fields/Microsoft.VSTS.Common.Severity",
-            "value": request_body.severity,
-        },
-        {
-            "op": "add",
-            "path": "/fields/Microsoft.VSTS.Common.Activity",
-            "value": request_body.activity,
-        },
+        {"op": "add", "path": path, "value": getattr(request_body, attr)}
+        for path, attr in _BUG_FIELD_PATHS
+    ]
+    patch_ops += [
         {
             "op": "add",
             "path": "/fields/Microsoft.VSTS.Common.ValueArea",
             "value": "Business",
         },
-        {"op": "add", "path": "/fields/Custom.Tester", "value": tester_principal},
-        {"op": "add", "path": "/fields/Custom.Cliente", "value": request_body.cliente},
-        {
-            "op": "add",
-            "path": "/fields/Custom.Tipodeerror",
-            "value": request_body.tipoDeError,
-        },
         {
             "op": "add",
             "path": "/fields/Custom.FechaInicioPlaneada",
             "value": fecha_con_hora,
         },
-        {
-            "op": "add",
-            "path": "/fields/Custom.ResponsableBug",
-            "value": request_body.responsableBug,
-        },
-        {
-            "op": "add",
-            "path": "/fields/Custom.33ece249-f3ca-4b23-a86a-0c605534caa3",
-            "value": request_body.aplicacion,
-        },
         {
             "op": "add",
             "path": "/fields/Custom.Tareaasociada",
             "value": str(request_body.tareaAsociada),
         },
-        {
-            "op": "add",
-            "path": "/fields/Custom.f82dc49a-eb67-44c3-ac65-de18fee91f0b",
-            "value": request_body.versionAplicacion,
-        },
-        {
-            "op": "add",
-            "path": "/fields/Custom.Funcionalidadquepresentaelerror",
-            "value": request_body.funcionalidad,
-        },
+        {"op": "add", "path": "/fields/Custom.Tester", "value": tester_principal},
         {
             "op": "add",
             "path": "/relations/-",
             "value": {
                 "rel": "System.LinkTypes.Hierarchy-Reverse",
-                "url": f"https://dev.azure.com/{org}/{project}/_apis/wit/workItems/{request_body.userStoryId}",
+                "url": _WORKITEM_REF_URL_TMPL.format(
+                    project=project, id=request_body.userStoryId
+                ),
                 "attributes": {"comment": "Parent User Story"},
             },
         },
     ]
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        resp = await client.post(url, headers=headers, json=patch_ops)
+    resp = await client.post(
+        url,
+        params=_API_VERSION_PARAMS,
+        headers=HEADERS_PATCH,
+        content=orjson.dumps(patch_ops),
+    )
 
-    if resp.status_code >= 400:
+    # Azure responde 200 al crear el work item; cualquier otro estado (p. ej.
+    # 203 con la página de login por un PAT inválido) se trata como error.
+    if resp.status_code != status.HTTP_200_OK:
         try:
-            azure_body = resp.json()
+            azure_body = orjson.loads(resp.content)
         except Exception:
             azure_body = {"raw_text": resp.text}
         raise HTTPException(
@@ -293,12 +485,27 @@ async def create_bug(request_body: BugCreateRequest):
             },
         )
 
-    try:
-        return JSONResponse(status_code=status.HTTP_201_CREATED, content=resp.json())
-    except Exception:
-        return JSONResponse(
-            status_code=status.HTTP_201_CREATED, content={"raw_text": resp.text}
-        )
+    return Response(
+        content=resp.content,
+        status_code=status.HTTP_201_CREATED,
+        media_type=resp.headers.get("content-type", "application/json"),
+    )
+
 
+# Mangum ejecutaría el lifespan completo en cada evento; el cliente se crea
+# bajo demanda en get_http_client().
+handler = Mangum(app, lifespan="off")
 
-handler = Mangum(app)
\ No newline at end of file
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "api.index:app",
+        host="0.0.0.0",
+        port=8000,
+        # "auto" usa uvloop y httptools cuando están instalados (no en Windows).
+        loop="auto",
+        http="auto",
+        workers=(os.cpu_count() or 1),
+    )
@@ -0,0 +1,162 @@
+import asyncio
+
+import httpx
+import pytest
+
+import api.index as index
+
+TESTER = "Antony Daniel Gutierrez Salgado"
+
+
+def member(display_name, principal):
+    return {"user": {"displayName": display_name, "principalName": principal}}
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    index._principal_cache.clear()
+    index._principal_inflight.clear()
+    yield
+    index._principal_cache.clear()
+    index._principal_inflight.clear()
+
+
+def mock_upstream(monkeypatch, *outcomes, gate=None):
+    """
+    Hace que el transporte base devuelva (o lance) cada resultado en orden.
+    Si se pasa gate, cada llamada espera a que el evento se active.
+    """
+    calls = []
+    pending = list(outcomes)
+
+    async def handle(self, request):
+        calls.append(str(request.url))
+        if gate is not None:
+            await gate.wait()
+        outcome = pending.pop(0) if len(pending) > 1 else pending[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(httpx.AsyncHTTPTransport, "handle_async_request", handle)
+    return calls
+
+
+def found(principal="t@x.com"):
+    return httpx.Response(200, json={"members": [member(TESTER, principal)]})
+
+
+def lookup(*names):
+    async def run():
+        async with httpx.AsyncClient() as client:
+            return [await index.find_user_principal_name(client, n) for n in names]
+
+    return asyncio.run(run())
+
+
+def test_concurrent_lookups_share_one_upstream_call(monkeypatch):
+    calls = mock_upstream(monkeypatch, found())
+
+    async def run():
+        async with httpx.AsyncClient() as client:
+            return await asyncio.gather(
+                *[index.find_user_principal_name(client, TESTER) for _ in range(5)]
+            )
+
+    assert asyncio.run(run()) == ["t@x.com"] * 5
+    assert len(calls) == 1
+    assert index._principal_inflight == {}
+
+
+def test_hit_is_served_from_cache(monkeypatch):
+    calls = mock_upstream(monkeypatch, found())
+    assert lookup(TESTER, TESTER) == ["t@x.com", "t@x.com"]
+    assert len(calls) == 1
+
+
+def test_expired_entry_is_fetched_again(monkeypatch):
+    calls = mock_upstream(monkeypatch, found("old@x.com"), found("new@x.com"))
+    monkeypatch.setattr(index, "PRINCIPAL_CACHE_TTL", -1.0)
+    assert lookup(TESTER, TESTER) == ["old@x.com", "new@x.com"]
+    assert len(calls) == 2
+
+
+def test_miss_is_not_cached(monkeypatch):
+    calls = mock_upstream(
+        monkeypatch,
+        httpx.Response(200, json={"members": [member("Otra Persona", "o@x.com")]}),
+        found(),
+    )
+    assert lookup(TESTER, TESTER) == [None, "t@x.com"]
+    assert len(calls) == 2
+
+
+def test_error_status_is_not_cached(monkeypatch):
+    calls = mock_upstream(monkeypatch, httpx.Response(500), found())
+    assert lookup(TESTER, TESTER) == [None, "t@x.com"]
+    assert len(calls) == 2
+
+
+def test_exception_reaches_all_waiters_and_is_not_cached(monkeypatch):
+    gate = asyncio.Event()
+    calls = mock_upstream(monkeypatch, httpx.ReadError("reset"), found(), gate=gate)
+
+    async def run():
+        async with httpx.AsyncClient() as client:
+            waiters = [
+                asyncio.create_task(index.find_user_principal_name(client, TESTER))
+                for _ in range(3)
+            ]
+            await asyncio.sleep(0)
+            gate.set()
+            results = await asyncio.gather(*waiters, return_exceptions=True)
+            assert index._principal_inflight == {}
+            results.append(await index.find_user_principal_name(client, TESTER))
+            return results
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, httpx.ReadError) for r in results[:3])
+    assert results[3] == "t@x.com"
+    assert len(calls) == 2
+
+
+def test_cancelling_one_waiter_does_not_cancel_the_others(monkeypatch):
+    gate = asyncio.Event()
+    calls = mock_upstream(monkeypatch, found(), gate=gate)
+
+    async def run():
+        async with httpx.AsyncClient() as client:
+            first = asyncio.create_task(index.find_user_principal_name(client, TESTER))
+            second = asyncio.create_task(
+                index.find_user_principal_name(client, TESTER)
+            )
+            await asyncio.sleep(0)
+            first.cancel()
+            await asyncio.sleep(0)
+            gate.set()
+            with pytest.raises(asyncio.CancelledError):
+                await first
+            return await second
+
+    assert asyncio.run(run()) == "t@x.com"
+    assert len(calls) == 1
+    assert index._principal_cache[(index.AZURE_ORG, TESTER)][1] == "t@x.com"
+
+
+def test_oldest_entry_is_evicted_when_full(monkeypatch):
+    mock_upstream(
+        monkeypatch,
+        httpx.Response(
+            200,
+            json={
+                "members": [
+                    member("A", "a@x.com"),
+                    member("B", "b@x.com"),
+                    member("C", "c@x.com"),
+                ]
+            },
+        ),
+    )
+    monkeypatch.setattr(index, "PRINCIPAL_CACHE_MAXSIZE", 2)
+    assert lookup("A", "B", "C") == ["a@x.com", "b@x.com", "c@x.com"]
+    assert [name for _, name in index._principal_cache] == ["B", "C"]
@@ -0,0 +1,203 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+from api.index import RetryTransport
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    return delays
+
+
+def mock_upstream(monkeypatch, *outcomes):
+    """Hace que el transporte base devuelva (o lance) cada resultado en orden."""
+    calls = []
+    pending = list(outcomes)
+
+    async def handle(self, request):
+        calls.append(request.method)
+        outcome = pending.pop(0) if len(pending) > 1 else pending[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(httpx.AsyncHTTPTransport, "handle_async_request", handle)
+    return calls
+
+
+def send(method, transport=None):
+    async def run():
+        async with httpx.AsyncClient(transport=transport or RetryTransport()) as c:
+            return await c.request(method, "https://dev.azure.com/org/_apis/x")
+
+    return asyncio.run(run())
+
+
+def test_get_retries_with_exponential_backoff(monkeypatch, sleeps):
+    calls = mock_upstream(
+        monkeypatch, httpx.Response(503), httpx.Response(502), httpx.Response(200)
+    )
+    assert send("GET").status_code == 200
+    assert len(calls) == 3
+    assert sleeps == [0.5, 1.0]
+
+
+def test_backoff_is_capped(monkeypatch, sleeps):
+    mock_upstream(monkeypatch, httpx.Response(503))
+    transport = RetryTransport(
+        max_retries=4, backoff_factor=10, max_backoff=25, max_total_delay=100
+    )
+    assert send("GET", transport).status_code == 503
+    assert sleeps == [10, 20, 25, 25]
+
+
+def test_gives_up_after_max_retries(monkeypatch, sleeps):
+    calls = mock_upstream(monkeypatch, httpx.Response(504))
+    assert send("GET").status_code == 504
+    assert len(calls) == 4
+
+
+def test_non_retryable_status_is_returned(monkeypatch, sleeps):
+    calls = mock_upstream(monkeypatch, httpx.Response(400))
+    assert send("GET").status_code == 400
+    assert len(calls) == 1
+    assert sleeps == []
+
+
+@pytest.mark.parametrize("status_code", [502, 504])
+def test_post_not_retried_when_azure_may_have_processed_it(
+    monkeypatch, sleeps, status_code
+):
+    calls = mock_upstream(monkeypatch, httpx.Response(status_code))
+    assert send("POST").status_code == status_code
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("status_code", [429, 503])
+def test_post_retried_when_azure_rejected_it(monkeypatch, sleeps, status_code):
+    calls = mock_upstream(
+        monkeypatch, httpx.Response(status_code), httpx.Response(200)
+    )
+    assert send("POST").status_code == 200
+    assert len(calls) == 2
+
+
+def test_retry_after_seconds_is_honoured_in_full(monkeypatch, sleeps):
+    mock_upstream(
+        monkeypatch,
+        httpx.Response(429, headers={"Retry-After": "45"}),
+        httpx.Response(200),
+    )
+    transport = RetryTransport(max_retry_after=60, max_total_delay=60)
+    assert send("POST", transport).status_code == 200
+    assert sleeps == [45.0]
+
+
+def test_retry_after_http_date(monkeypatch, sleeps):
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=20)
+    mock_upstream(
+        monkeypatch,
+        httpx.Response(503, headers={"Retry-After": format_datetime(retry_at, True)}),
+        httpx.Response(200),
+    )
+    transport = RetryTransport(max_retry_after=60, max_total_delay=60)
+    assert send("GET", transport).status_code == 200
+    assert len(sleeps) == 1
+    assert 15 < sleeps[0] <= 20
+
+
+def test_retry_after_over_budget_returns_response(monkeypatch, sleeps):
+    calls = mock_upstream(
+        monkeypatch, httpx.Response(429, headers={"Retry-After": "120"})
+    )
+    assert send("GET").status_code == 429
+    assert len(calls) == 1
+    assert sleeps == []
+
+
+def test_total_delay_budget_returns_last_response(monkeypatch, sleeps):
+    calls = mock_upstream(
+        monkeypatch, httpx.Response(429, headers={"Retry-After": "2"})
+    )
+    assert send("GET").status_code == 429
+    assert sleeps == [2.0, 2.0]
+    assert len(calls) == 3
+
+
+def test_total_delay_budget_reraises_errors(monkeypatch, sleeps):
+    calls = mock_upstream(monkeypatch, httpx.ConnectError("refused"))
+    transport = RetryTransport(backoff_factor=1, max_total_delay=2)
+    with pytest.raises(httpx.ConnectError):
+        send("GET", transport)
+    assert sleeps == [1]
+    assert len(calls) == 2
+
+
+def test_invalid_retry_after_falls_back_to_backoff(monkeypatch, sleeps):
+    mock_upstream(
+        monkeypatch,
+        httpx.Response(429, headers={"Retry-After": "soon"}),
+        httpx.Response(200),
+    )
+    assert send("GET").status_code == 200
+    assert sleeps == [0.5]
+
+
+@pytest.mark.parametrize("method", ["GET", "POST"])
+def test_connect_errors_are_retried(monkeypatch, sleeps, method):
+    calls = mock_upstream(
+        monkeypatch, httpx.ConnectError("refused"), httpx.Response(200)
+    )
+    assert send(method).status_code == 200
+    assert len(calls) == 2
+
+
+def test_connect_errors_raise_after_max_retries(monkeypatch, sleeps):
+    calls = mock_upstream(monkeypatch, httpx.ConnectError("refused"))
+    with pytest.raises(httpx.ConnectError):
+        send("GET")
+    assert len(calls) == 4
+
+
+def test_read_error_retried_for_get(monkeypatch, sleeps):
+    calls = mock_upstream(monkeypatch, httpx.ReadError("reset"), httpx.Response(200))
+    assert send("GET").status_code == 200
+    assert len(calls) == 2
+
+
+def test_read_error_not_retried_for_post(monkeypatch, sleeps):
+    calls = mock_upstream(monkeypatch, httpx.ReadError("reset"))
+    with pytest.raises(httpx.ReadError):
+        send("POST")
+    assert len(calls) == 1
+
+
+def test_semaphore_slot_is_released_while_waiting(monkeypatch):
+    semaphore = asyncio.Semaphore(1)
+    held_during_send = []
+    held_during_sleep = []
+    pending = [httpx.Response(429, headers={"Retry-After": "1"}), httpx.Response(200)]
+
+    async def handle(self, request):
+        held_during_send.append(semaphore.locked())
+        return pending.pop(0)
+
+    async def fake_sleep(delay):
+        held_during_sleep.append(semaphore.locked())
+
+    monkeypatch.setattr(httpx.AsyncHTTPTransport, "handle_async_request", handle)
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    assert send("GET", RetryTransport(semaphore=semaphore)).status_code == 200
+    assert held_during_send == [True, True]
+    assert held_during_sleep == [False]
+    assert not semaphore.locked()